@@ -1,3 +1,18 @@
+from event_statemachine.cache import TransitionCache
+
+
+def _cache_fields(transitions):
+    fields = set()
+    for state_transition in transitions:
+        if "event_condition" not in state_transition:
+            continue
+        cache_on = state_transition.get("cache_on")
+        if cache_on is None:
+            return None
+        fields.update(cache_on)
+    return tuple(sorted(fields))
+
+
 class HandlerMeta(type):
     def __init__(cls, name, bases, dct):
         super().__init__(name, bases, dct)
@@ -12,6 +27,13 @@ class HandlerMeta(type):
                 }
                 if hasattr(value, "event_condition"):
                     next_state["event_condition"] = value.event_condition
+                    cache_on = getattr(value, "cache_on", None)
+                    if cache_on is not None:
+                        if "context" in value.event_condition.__code__.co_names:
+                            raise ValueError(
+                                f"La condición de {name} usa el contexto y no se puede cachear"
+                            )
+                        next_state["cache_on"] = cache_on
                 next_states = cls.transitions.get(value.state, [])
                 next_states.append(next_state)
                 cls.transitions[value.state] = next_states
@@ -19,3 +41,18 @@ class HandlerMeta(type):
                 cls.on_entries[value.on_entry] = value
             if hasattr(value, "on_exit"):
                 cls.on_exits[value.on_exit] = value
+        state_names = set()
+        for state, state_transitions in cls.transitions.items():
+            state_names.add(state)
+            for state_transition in state_transitions:
+                state_names.update(state_transition["next_state"].split(","))
+        state_names.discard("Any")
+        cls.state_names = tuple(sorted(state_names))
+        any_transitions = cls.transitions.get("Any", [])
+        cls.cache_fields = {
+            state: _cache_fields(state_transitions + any_transitions)
+            for state, state_transitions in cls.transitions.items()
+        }
+        cls.cache_fields["Any"] = _cache_fields(any_transitions)
+        cache_size = getattr(cls, "transition_cache_size", 0)
+        cls._transition_cache = TransitionCache(cache_size) if cache_size else None
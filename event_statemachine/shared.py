@@ -0,0 +1,265 @@
+"""Shared memory table with the current state of many state machines.
+
+It requires Python 3.8+ (``multiprocessing.shared_memory``).
+"""
+import os
+import sys
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# header: capacity, number of states, used slots, histogram sequence, free slots,
+# pid of the resource tracker of the owner
+_HEADER_SIZE = 6
+# slot: sequence, state code, version
+_SLOT_SIZE = 3
+_ITEM_SIZE = 8
+
+
+class _SharedMemory(SharedMemory):
+    # the view must be released before closing, whatever object is finalized first
+    view = None
+
+    def close(self) -> None:
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        super().close()
+
+
+def _get_tracker_pid() -> int:
+    return getattr(resource_tracker._resource_tracker, "_pid", None) or 0
+
+
+def _attach(name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return _SharedMemory(name=name, track=False)
+    return _SharedMemory(name=name)
+
+
+def _untrack(shm: SharedMemory, owner_tracker_pid: int) -> None:
+    # the resource tracker of a reader would destroy the block when the reader exits,
+    # unless it is the tracker of the owner (same process or a forked one)
+    if sys.version_info >= (3, 13) or os.name != "posix":
+        return
+    if _get_tracker_pid() != owner_tracker_pid:
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+class SharedStateTable:
+    """Table stored in shared memory with the interned state and the version of each
+    registered state machine, and the number of state machines in each state.
+
+    Only one process (the owner of the state machines) must write to the table.
+    Other processes can attach to it by name and read it without locks, the
+    writes are protected by sequence counters (seqlock).
+
+    It is used in the following way:
+
+    .. code-block:: python
+
+        # owner process
+        table = SharedStateTable(Turnstile.state_names, capacity=1000, name="turnstiles")
+        sm = Turnstile(initial_state="Locked", state_table=table)
+        # the same state machine, rebuilt later with its context
+        sm = Turnstile(initial_state=state, state_table=table, state_slot=sm.state_slot)
+        # the state machine is no longer used
+        table.unregister(sm.state_slot)
+
+        # reader process
+        with SharedStateTable(Turnstile.state_names, name="turnstiles", create=False) as table:
+            table.count("Locked")
+
+    Args:
+        states (Iterable[str]): state names, in the same order for every process.
+        capacity (int, optional): maximum number of state machines. Defaults to 1024.
+        name (Optional[str], optional): name of the shared memory block. Defaults to None
+        (a random name is generated).
+        create (bool, optional): create the block instead of attaching to an existing one.
+        Defaults to True.
+        timeout (float, optional): seconds a reader waits for a consistent value before
+        raising ``TimeoutError``, e.g. if the writer died in the middle of a write.
+        Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        states: Iterable[str],
+        capacity: int = 1024,
+        name: Optional[str] = None,
+        create: bool = True,
+        timeout: float = 1,
+    ):
+        self.states = tuple(states)
+        self.timeout = timeout
+        self._codes = {state: code for code, state in enumerate(self.states, start=1)}
+        if create:
+            size = (
+                _HEADER_SIZE + len(self.states) + capacity * (_SLOT_SIZE + 1)
+            ) * _ITEM_SIZE
+            self._shm = _SharedMemory(name=name, create=True, size=size)
+            self._shm.buf[:size] = bytes(size)
+            self._shm.view = self._buf = self._shm.buf.cast("Q")
+            self._buf[0] = capacity
+            self._buf[1] = len(self.states)
+            self._buf[5] = _get_tracker_pid()
+        else:
+            self._shm = _attach(name)
+            self._shm.view = self._buf = self._shm.buf.cast("Q")
+            _untrack(self._shm, self._buf[5])
+            if self._buf[1] != len(self.states):
+                self.close()
+                raise ValueError("Los estados no coinciden con los de la tabla")
+        self.capacity = self._buf[0]
+        self._slots_offset = _HEADER_SIZE + len(self.states)
+        self._free_offset = self._slots_offset + self.capacity * _SLOT_SIZE
+
+    def __enter__(self) -> "SharedStateTable":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_shm"):
+            self.close()
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block, used to attach from other processes."""
+        return self._shm.name
+
+    def register(self, state: str) -> int:
+        """Reserve a slot for a state machine, reusing the released ones.
+
+        Args:
+            state (str): current state of the state machine.
+
+        Returns:
+            int: slot of the state machine.
+        """
+        code = self.__get_code(state)
+        free_slots = self._buf[4]
+        if free_slots:
+            slot = self._buf[self._free_offset + free_slots - 1]
+            self._buf[4] = free_slots - 1
+        else:
+            slot = self._buf[2]
+            if slot >= self.capacity:
+                raise ValueError(
+                    f"La tabla no tiene lugar para más de {self.capacity} máquinas"
+                )
+            self._buf[2] = slot + 1
+        self.__write(slot, code, 0)
+        return slot
+
+    def unregister(self, slot: int) -> None:
+        """Release the slot of a state machine that is no longer used.
+
+        Args:
+            slot (int): slot obtained from ``register()``.
+        """
+        base = self.__get_registered_slot_base(slot)
+        self.__write(slot, 0, self._buf[base + 2] + 1)
+        free_slots = self._buf[4]
+        self._buf[self._free_offset + free_slots] = slot
+        self._buf[4] = free_slots + 1
+
+    def write(self, slot: int, state: str) -> None:
+        """Set the state of a state machine and increment its version.
+
+        Args:
+            slot (int): slot obtained from ``register()``.
+            state (str): new state of the state machine.
+        """
+        base = self.__get_registered_slot_base(slot)
+        self.__write(slot, self.__get_code(state), self._buf[base + 2] + 1)
+
+    def read(self, slot: int) -> Tuple[Optional[str], int]:
+        """Obtain the state of a state machine.
+
+        Args:
+            slot (int): slot of the state machine.
+
+        Returns:
+            Tuple[Optional[str], int]: state and version of the state machine, the
+            state is None if the slot was released.
+        """
+        base = self.__get_slot_base(slot)
+        code, version = self.__read_consistent(
+            base, lambda: (self._buf[base + 1], self._buf[base + 2])
+        )
+        return (self.states[code - 1] if code else None, version)
+
+    def count(self, state: str) -> int:
+        """Obtain the number of state machines in a state.
+
+        Args:
+            state (str): state name.
+
+        Returns:
+            int: number of state machines.
+        """
+        return self._buf[_HEADER_SIZE + self.__get_code(state) - 1]
+
+    def histogram(self) -> Dict[str, int]:
+        """Obtain the number of state machines in each state.
+
+        Returns:
+            Dict[str, int]: number of state machines by state name.
+        """
+        start = _HEADER_SIZE
+        end = _HEADER_SIZE + len(self.states)
+        counts = self.__read_consistent(3, lambda: self._buf[start:end].tolist())
+        return dict(zip(self.states, counts))
+
+    def close(self) -> None:
+        """Close the access to the table from this process."""
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Destroy the shared memory block. Call it once, from the owner process."""
+        self._shm.unlink()
+
+    def __get_code(self, state: str) -> int:
+        if state not in self._codes:
+            raise ValueError(f"El estado {state} no es válido")
+        return self._codes[state]
+
+    def __get_slot_base(self, slot: int) -> int:
+        if not 0 <= slot < self._buf[2]:
+            raise ValueError(f"El slot {slot} no es válido")
+        return self._slots_offset + slot * _SLOT_SIZE
+
+    def __get_registered_slot_base(self, slot: int) -> int:
+        base = self.__get_slot_base(slot)
+        if not self._buf[base + 1]:
+            raise ValueError(f"El slot {slot} no está registrado")
+        return base
+
+    def __read_consistent(self, seq_index: int, read: Callable):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            seq = self._buf[seq_index]
+            if not seq & 1:
+                value = read()
+                if self._buf[seq_index] == seq:
+                    return value
+            if time.monotonic() > deadline:
+                raise TimeoutError("No se pudo leer un valor consistente de la tabla")
+            time.sleep(0)
+
+    def __write(self, slot: int, code: int, version: int) -> None:
+        base = self._slots_offset + slot * _SLOT_SIZE
+        old_code = self._buf[base + 1]
+        self._buf[3] += 1
+        self._buf[base] += 1
+        self._buf[base + 1] = code
+        self._buf[base + 2] = version
+        if old_code:
+            self._buf[_HEADER_SIZE + old_code - 1] -= 1
+        if code:
+            self._buf[_HEADER_SIZE + code - 1] += 1
+        self._buf[base] += 1
+        self._buf[3] += 1
@@ -1,7 +1,9 @@
 """Main module."""
 import logging
-from typing import Any, Callable, Optional
+from collections import deque
+from typing import Any, Callable, Iterable, Optional
 
+from event_statemachine.cache import _MISSING, CacheInfo
 from event_statemachine.handler import HandlerMeta
 from event_statemachine.context import Context
 
@@ -35,7 +37,9 @@ def transition(transition_name: str) -> Callable:
     return decorator
 
 
-def event_condition(condition: Callable) -> Callable:
+def event_condition(
+    condition: Callable, cache_on: Optional[Iterable[str]] = None
+) -> Callable:
     """Decorator to define a condition for an event.
     The condition is a funtion that receives `self` from the state machine.
     It's use to control the flow of the state machine, and validate the
@@ -51,13 +55,38 @@ def event_condition(condition: Callable) -> Callable:
             pass
 
 
+    If the condition is a pure function of some fields of the event, they can be
+    declared with ``cache_on`` so the selected transition is memoized when the
+    state machine defines ``transition_cache_size``:
+
+    .. code-block:: python
+
+        @transition("StateFrom -> StateTo")
+        @event_condition(
+            lambda self: self.evt.get("action") == "coin", cache_on=("action",)
+        )
+        def handler_function(self):
+            pass
+
+    ``cache_on`` is a declaration that the condition is a pure function of those
+    fields. Only direct ``self.context`` references in the condition are detected, and
+    they raise a ``ValueError`` when the class is defined; conditions that read the
+    context or other mutable state indirectly must not declare ``cache_on``.
+
+    Looking up the cache has a cost, it only pays off for states with several
+    conditions or expensive ones.
+
     Args:
         condition (Callable): a function that receives `self` from the state machine
         and returns a boolean.
+        cache_on (Optional[Iterable[str]], optional): event fields the condition depends on.
+        Defaults to None (not memoized).
     """
 
     def decorator(func):
         func.event_condition = condition
+        if cache_on is not None:
+            func.cache_on = tuple(cache_on)
         return func
 
     return decorator
@@ -116,16 +145,59 @@ def on_state_exit(state: str) -> Callable:
 class StateMachine(metaclass=HandlerMeta):
     """Base class for a state machine.
 
+    Set ``transition_cache_size`` in a subclass to memoize the transition selected for
+    conditions declared with ``cache_on``. The cache is shared by all the instances of
+    the class.
+
+    Handlers can raise follow-up events with ``post()``. They are processed by
+    ``run_state`` in run-to-completion order, before any pending external event, up to
+    ``max_internal_events`` internal events in a row.
+
     Args:
         initial_state (str, optional): Initial state of the state machine. Defaults to "Initial".
+        state_table (Optional[SharedStateTable], optional): table where the state of the
+        state machine is published on every transition. Defaults to None.
+        state_slot (Optional[int], optional): slot of the table already reserved for this
+        state machine, e.g. when it is rebuilt with ``set_context()``. Defaults to None
+        (a new slot is reserved, release it with ``state_table.unregister(sm.state_slot)``).
     """
 
-    def __init__(self, initial_state: Optional[str] = "Initial"):
+    transition_cache_size = 0
+    max_internal_events = 100
+
+    def __init__(
+        self,
+        initial_state: Optional[str] = "Initial",
+        state_table=None,
+        state_slot: Optional[int] = None,
+    ):
         if self.transitions is None:
             raise ValueError("No se encontraron transiciones")
+        self._state_table = None
+        self.state_slot = state_slot
         self.current_state = initial_state
+        if state_table is not None:
+            if state_slot is None:
+                self.state_slot = state_table.register(initial_state)
+            elif state_table.read(state_slot)[0] != initial_state:
+                state_table.write(state_slot, initial_state)
+            self._state_table = state_table
         self.evt = {}
         self.context = Context()
+        self._internal_events = deque()
+        self._external_events = deque()
+        self._running = False
+
+    @property
+    def current_state(self) -> str:
+        """Current state of the state machine."""
+        return self._current_state
+
+    @current_state.setter
+    def current_state(self, state: str) -> None:
+        self._current_state = state
+        if self._state_table is not None:
+            self._state_table.write(self.state_slot, state)
 
     def get_context(self) -> dict:
         """Obtain the context of the state machine.
@@ -183,15 +255,94 @@ class StateMachine(metaclass=HandlerMeta):
             Any: custom value to return
         """
 
+    @classmethod
+    def transition_cache_info(cls) -> Optional[CacheInfo]:
+        """Obtain the statistics of the transition cache.
+
+        Returns:
+            Optional[CacheInfo]: ``(hits, misses, maxsize, currsize)``, or None if the
+            cache is disabled.
+        """
+        if cls._transition_cache is None:
+            return None
+        return cls._transition_cache.info()
+
+    @classmethod
+    def transition_cache_clear(cls) -> None:
+        """Clear the transition cache and its statistics."""
+        if cls._transition_cache is not None:
+            cls._transition_cache.clear()
+
+    def post(self, event: Any) -> None:
+        """Queue an internal event, usually from a handler. It is processed after the
+        current event and before any pending external event.
+
+        Args:
+            event (Any): The data of the event.
+        """
+        self._internal_events.append(event)
+
     def run_state(self, event: Optional[Any] = None) -> Any:
         """Method to run the state machine.
 
+        The event and every internal event posted while handling it are processed
+        before returning, and ``self.evt`` is restored to the event before calling the
+        ``on_return`` hook.
+
+        If it is called from a handler, the event is queued, it is processed after the
+        internal events and the call returns None instead of the ``on_return`` value.
+
+        If more than ``max_internal_events`` internal events are processed in a row, a
+        ``RuntimeError`` is raised and the pending internal events are discarded. The
+        queued external events are kept and processed in the next call. If a handler
+        raises any other exception, all the queued events are discarded.
+
         Args:
             event (Optional[Any], optional): The data of the event. Defaults to None.
 
         Returns:
             Any: The value returned by the ``on_return`` hook.
         """
+        if self._running:
+            self._external_events.append(event)
+            return None
+        self._running = True
+        try:
+            if self._internal_events or self._external_events:
+                self._external_events.append(event)
+            else:
+                self.__run_event(event)
+            overflow = False
+            if self._internal_events or self._external_events:
+                overflow = self.__run_queued_events()
+        except BaseException:
+            self._internal_events.clear()
+            self._external_events.clear()
+            raise
+        finally:
+            self._running = False
+        if overflow:
+            raise RuntimeError(
+                f"Se superó el máximo de {self.max_internal_events} eventos internos"
+            )
+        self.evt = event or {}
+        return self.on_return()
+
+    def __run_queued_events(self) -> bool:
+        internal_depth = 0
+        while self._internal_events or self._external_events:
+            if self._internal_events:
+                internal_depth += 1
+                if internal_depth > self.max_internal_events:
+                    self._internal_events.clear()
+                    return True
+                self.__run_event(self._internal_events.popleft())
+            else:
+                internal_depth = 0
+                self.__run_event(self._external_events.popleft())
+        return False
+
+    def __run_event(self, event: Optional[Any]) -> None:
         self.evt = event or {}
         logger.debug("Current state: %s", self.current_state)
         logger.debug("Receive event: %s", self.evt)
@@ -209,7 +360,6 @@ class StateMachine(metaclass=HandlerMeta):
                 valid_transition, alternative_next_state
             )
         self.on_exit()
-        return self.on_return()
 
     def __valid_transition_condition(self, transition):
         condition = transition.get("event_condition")
@@ -224,13 +374,39 @@ class StateMachine(metaclass=HandlerMeta):
             )
 
     def __get_transition_for_state(self, state: str) -> Optional[dict]:
+        cache_key = self.__get_cache_key(state)
+        if cache_key is not None:
+            cached_transition = self._transition_cache.get(cache_key)
+            if cached_transition is not _MISSING:
+                return cached_transition
+
         current_transitions = self.transitions.get(state, [])
         any_transitions = self.transitions.get("Any", [])
-        current_transitions.extend(any_transitions)
-        for state_transition in current_transitions:
+        valid_transition = None
+        for state_transition in current_transitions + any_transitions:
             if self.__valid_transition_condition(state_transition):
-                return state_transition
-        return None
+                valid_transition = state_transition
+                break
+
+        if cache_key is not None:
+            self._transition_cache.set(cache_key, valid_transition)
+        return valid_transition
+
+    def __get_cache_key(self, state: str) -> Optional[tuple]:
+        if self._transition_cache is None:
+            return None
+        fields = self.cache_fields.get(state, self.cache_fields["Any"])
+        if fields is None:
+            return None
+        try:
+            cache_key = (
+                state,
+                tuple(self.evt.get(field, _MISSING) for field in fields),
+            )
+            hash(cache_key)
+        except (AttributeError, TypeError):
+            return None
+        return cache_key
 
     def __run_on_entry_handler(self, state: str) -> None:
         if self.on_entries.get(state):
@@ -2,6 +2,11 @@
 
 """Tests for `event_statemachine` package."""
 
+import copy
+import subprocess
+import sys
+import textwrap
+
 import pytest
 
 from event_statemachine import (
@@ -145,3 +150,412 @@ def test_state_on_exit(sm_class):
     event = {"next_state": "StateEntry"}
     sm.run_state(event)
     assert sm.on_exitstate_executed is True
+
+
+@pytest.fixture
+def cached_sm_class():
+    class CachedStateMachine(StateMachine):
+        transition_cache_size = 2
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.context.enabled = True
+
+        @transition("Locked -> Unlocked")
+        @event_condition(
+            lambda self: self.evt.get("action") == "coin"
+            and self.evt.get("coin") == "valid",
+            cache_on=("action", "coin"),
+        )
+        def on_coin(self):
+            pass
+
+        @transition("Unlocked -> Locked")
+        @event_condition(
+            lambda self: self.evt.get("action") == "push", cache_on=("action",)
+        )
+        def on_push(self):
+            pass
+
+        @transition("Open -> Closed")
+        @event_condition(
+            lambda self: self.context.enabled and self.evt.get("action") == "close"
+        )
+        def on_close(self):
+            pass
+
+        @transition("Empty -> Full")
+        @event_condition(lambda self: "coin" in self.evt, cache_on=("coin",))
+        def on_fill(self):
+            pass
+
+    return CachedStateMachine
+
+
+def test_transition_cache_disabled(sm_class):
+    assert sm_class.transition_cache_info() is None
+
+
+def test_transition_cache_hits(cached_sm_class):
+    sm = cached_sm_class(initial_state="Locked")
+    sm.run_state({"action": "coin", "coin": "invalid"})
+    assert sm.current_state == "Locked"
+    sm.run_state({"action": "coin", "coin": "invalid", "id": 1})
+    assert sm.current_state == "Locked"
+    sm.run_state({"action": "coin", "coin": "valid"})
+    assert sm.current_state == "Unlocked"
+
+    sm2 = cached_sm_class(initial_state="Locked")
+    sm2.run_state({"action": "coin", "coin": "valid", "id": 2})
+    assert sm2.current_state == "Unlocked"
+    assert cached_sm_class.transition_cache_info() == (2, 2, 2, 2)
+
+    cached_sm_class.transition_cache_clear()
+    assert cached_sm_class.transition_cache_info() == (0, 0, 2, 0)
+
+
+def test_transition_cache_is_bounded(cached_sm_class):
+    sm = cached_sm_class(initial_state="Locked")
+    for coin in ("a", "b", "c", "a"):
+        sm.run_state({"action": "coin", "coin": coin})
+    assert cached_sm_class.transition_cache_info() == (0, 4, 2, 2)
+
+
+def test_transition_cache_skips_undeclared_conditions(cached_sm_class):
+    sm = cached_sm_class(initial_state="Open")
+    sm.context.enabled = False
+    sm.run_state({"action": "close"})
+    assert sm.current_state == "Open"
+    sm.context.enabled = True
+    sm.run_state({"action": "close"})
+    assert sm.current_state == "Closed"
+    assert cached_sm_class.transition_cache_info().currsize == 0
+
+
+def test_transition_cache_rejects_context():
+    with pytest.raises(ValueError):
+
+        class ContextStateMachine(StateMachine):
+            @transition("Open -> Closed")
+            @event_condition(lambda self: self.context.enabled, cache_on=("action",))
+            def on_close(self):
+                pass
+
+
+def test_transition_cache_missing_field(cached_sm_class):
+    sm = cached_sm_class(initial_state="Empty")
+    sm.run_state({"other": 1})
+    assert sm.current_state == "Empty"
+    sm.run_state({"coin": None})
+    assert sm.current_state == "Full"
+    assert cached_sm_class.transition_cache_info().hits == 0
+
+
+@pytest.fixture
+def queue_sm_class():
+    class QueueStateMachine(StateMachine):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.context.log = []
+
+        def on_entry(self):
+            self.context.log.append(("entry", self.evt.get("name")))
+
+        def on_exit(self):
+            self.context.log.append(("exit", self.evt.get("name")))
+
+        def on_return(self):
+            return self.evt
+
+        @transition("Initial -> Started")
+        def on_start(self):
+            self.post({"name": "internal1"})
+            self.context.reentrant = self.run_state({"name": "external"})
+            self.post({"name": "internal2"})
+
+        @transition("Started -> Running")
+        def on_run(self):
+            pass
+
+        @transition("Running -> Finished")
+        def on_finish(self):
+            pass
+
+        @transition("Finished -> Initial")
+        @event_condition(lambda self: self.evt.get("name") == "reset")
+        def on_reset(self):
+            self.post({"name": "start"})
+
+        @transition("Burst -> Loop")
+        def on_burst(self):
+            self.run_state({"name": "queued"})
+            self.post({"name": "loop"})
+
+        @transition("Loop -> Loop")
+        def on_loop(self):
+            self.post({"name": "loop"})
+
+        @transition("Fail -> Started")
+        def on_fail(self):
+            self.post({"name": "internal"})
+            self.run_state({"name": "reentrant"})
+            raise KeyError("fail")
+
+    return QueueStateMachine
+
+
+def test_post_run_to_completion(queue_sm_class):
+    sm = queue_sm_class()
+    assert sm.run_state({"name": "start"}) == {"name": "start"}
+    assert sm.evt == {"name": "start"}
+    assert sm.context.reentrant is None
+    assert sm.current_state == "Finished"
+    assert sm.context.log == [
+        ("entry", "start"),
+        ("exit", "start"),
+        ("entry", "internal1"),
+        ("exit", "internal1"),
+        ("entry", "internal2"),
+        ("exit", "internal2"),
+        ("entry", "external"),
+        ("exit", "external"),
+    ]
+
+
+def test_post_max_internal_events(queue_sm_class):
+    queue_sm_class.max_internal_events = 5
+    sm = queue_sm_class(initial_state="Loop")
+    with pytest.raises(RuntimeError):
+        sm.run_state({"name": "loop"})
+    assert len(sm.context.log) == 12
+
+    sm.context.log = []
+    with pytest.raises(RuntimeError):
+        sm.run_state({"name": "loop"})
+    assert len(sm.context.log) == 12
+
+
+def test_post_max_internal_events_keeps_external_events(queue_sm_class):
+    queue_sm_class.max_internal_events = 5
+    sm = queue_sm_class(initial_state="Burst")
+    with pytest.raises(RuntimeError):
+        sm.run_state({"name": "burst"})
+
+    sm.current_state = "Finished"
+    sm.context.log = []
+    sm.run_state({"name": "next"})
+    assert sm.context.log == [
+        ("entry", "queued"),
+        ("exit", "queued"),
+        ("entry", "next"),
+        ("exit", "next"),
+    ]
+
+
+def test_post_handler_exception_discards_events(queue_sm_class):
+    sm = queue_sm_class(initial_state="Fail")
+    with pytest.raises(KeyError):
+        sm.run_state({"name": "fail"})
+
+    sm.current_state = "Finished"
+    sm.context.log = []
+    sm.run_state({"name": "retry"})
+    assert sm.context.log == [("entry", "retry"), ("exit", "retry")]
+
+
+def test_post_replay(queue_sm_class):
+    events = [
+        {"name": "start"},
+        {"name": "other"},
+        {"name": "reset"},
+        {"name": "other"},
+    ]
+
+    live = queue_sm_class()
+    for event in events:
+        live.run_state(event)
+
+    state = "Initial"
+    context = None
+    for event in events:
+        sm = queue_sm_class(initial_state=state)
+        if context is not None:
+            sm.set_context(copy.deepcopy(context))
+        sm.run_state(event)
+        state = sm.current_state
+        context = copy.deepcopy(sm.get_context())
+
+    assert live.current_state == "Finished"
+    assert state == live.current_state
+    assert context == live.get_context()
+    assert context["log"][-8:] == [
+        ("entry", "internal1"),
+        ("exit", "internal1"),
+        ("entry", "internal2"),
+        ("exit", "internal2"),
+        ("entry", "external"),
+        ("exit", "external"),
+        ("entry", "other"),
+        ("exit", "other"),
+    ]
+
+
+@pytest.fixture
+def state_table(sm_class):
+    shared = pytest.importorskip("event_statemachine.shared")
+    table = shared.SharedStateTable(sm_class.state_names, capacity=2)
+    yield table
+    table.close()
+    table.unlink()
+
+
+def test_state_names(sm_class):
+    assert sm_class.state_names == (
+        "Initial",
+        "State1",
+        "State2",
+        "State3a",
+        "State3b",
+        "StateEntry",
+    )
+
+
+def test_shared_state_table(sm_class, state_table):
+    sm = sm_class(state_table=state_table)
+    sm2 = sm_class(initial_state="State2", state_table=state_table)
+    assert state_table.read(0) == ("Initial", 0)
+    assert state_table.histogram()["Initial"] == 1
+
+    sm.run_state()
+    sm.run_state()
+    sm2.run_state({"next_state": "State3a"})
+    sm2.run_state({"next_state": "State3a"})
+    assert state_table.read(0) == ("State2", 2)
+    assert state_table.read(1) == ("State3a", 1)
+    assert state_table.count("Initial") == 0
+    assert state_table.count("State2") == 1
+
+    shared = pytest.importorskip("event_statemachine.shared")
+    with shared.SharedStateTable(
+        sm_class.state_names, name=state_table.name, create=False
+    ) as reader:
+        assert reader.read(1) == ("State3a", 1)
+        assert reader.histogram() == {
+            "Initial": 0,
+            "State1": 0,
+            "State2": 1,
+            "State3a": 1,
+            "State3b": 0,
+            "StateEntry": 0,
+        }
+
+    with pytest.raises(ValueError):
+        sm_class(state_table=state_table)
+
+
+def test_shared_state_table_release_slot(sm_class, state_table):
+    sm = sm_class(state_table=state_table)
+    sm.run_state()
+    for _ in range(3):
+        stateless_sm = sm_class(initial_state="State1", state_table=state_table)
+        state_table.unregister(stateless_sm.state_slot)
+    assert state_table.read(1) == (None, 1)
+    assert state_table.count("State1") == 1
+
+    sm2 = sm_class(
+        initial_state=sm.current_state, state_table=state_table, state_slot=0
+    )
+    assert state_table.read(0) == ("State1", 1)
+    sm2.run_state()
+    assert state_table.read(0) == ("State2", 2)
+    assert state_table.histogram()["State2"] == 1
+
+    with pytest.raises(ValueError):
+        state_table.write(1, "State1")
+
+
+def test_shared_state_table_timeout(sm_class):
+    shared = pytest.importorskip("event_statemachine.shared")
+    with shared.SharedStateTable(
+        sm_class.state_names, capacity=1, timeout=0.01
+    ) as table:
+        table.register("Initial")
+        # a writer that died in the middle of a write
+        table._buf[3] += 1
+        with pytest.raises(TimeoutError):
+            table.histogram()
+        table.unlink()
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-c", textwrap.dedent(code)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def test_shared_state_table_subprocess_reader(sm_class, state_table):
+    sm = sm_class(state_table=state_table)
+    sm.run_state()
+    code = f"""
+        from event_statemachine.shared import SharedStateTable
+
+        with SharedStateTable({sm_class.state_names!r}, name={state_table.name!r},
+                              create=False) as table:
+            print(table.read(0), table.count("State1"))
+        """
+    for _ in range(2):
+        result = run_python(code)
+        assert result.stdout == "('State1', 1) 1\n"
+        assert result.stderr == ""
+    sm.run_state()
+    assert state_table.read(0) == ("State2", 2)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fork is not available")
+def test_shared_state_table_fork_reader():
+    pytest.importorskip("event_statemachine.shared")
+    result = run_python(
+        """
+        import multiprocessing
+
+        from event_statemachine.shared import SharedStateTable
+
+        def read(name):
+            with SharedStateTable(("A",), name=name, create=False) as table:
+                assert table.read(0) == ("A", 0)
+
+        table = SharedStateTable(("A",))
+        table.register("A")
+        context = multiprocessing.get_context("fork")
+        process = context.Process(target=read, args=(table.name,))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        table.close()
+        table.unlink()
+        """
+    )
+    assert result.stderr == ""
+
+
+def test_shared_state_table_not_closed():
+    pytest.importorskip("event_statemachine.shared")
+    result = run_python(
+        """
+        import gc
+
+        from event_statemachine.shared import SharedStateTable
+
+        table = SharedStateTable(("A",))
+        table.register("A")
+        table.unlink()
+        # collected by the garbage collector, without calling close()
+        table.cycle = table
+        del table
+        gc.collect()
+        """
+    )
+    assert result.stderr == ""